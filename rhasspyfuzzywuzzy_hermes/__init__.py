@@ -1,17 +1,22 @@
 """Hermes MQTT server for Rhasspy fuzzywuzzy"""
-import json
+import asyncio
+import functools
 import logging
-import sqlite3
+import re
+import socket
+import sys
 import typing
+from collections import OrderedDict
 from pathlib import Path
 
 import networkx as nx
-import rhasspyfuzzywuzzy
 import rhasspynlu
+from rhasspyfuzzywuzzy.const import ExamplesType
 from rhasspyhermes.base import Message
 from rhasspyhermes.client import GeneratorType, HermesClient, TopicArgs
 from rhasspyhermes.intent import Intent, Slot, SlotRange
 from rhasspyhermes.nlu import (
+    AsrToken,
     NluError,
     NluIntent,
     NluIntentNotRecognized,
@@ -20,13 +25,38 @@ from rhasspyhermes.nlu import (
     NluTrain,
     NluTrainSuccess,
 )
+from rhasspynlu.intent import Recognition
 from rhasspynlu.jsgf import Sentence
 
+from . import _rapid
+from .utils import (
+    file_digest,
+    json_dumps,
+    message_to_dict,
+    read_examples,
+    read_graph,
+    write_examples,
+)
+
 _LOGGER = logging.getLogger("rhasspyfuzzywuzzy_hermes")
 
+_DIGITS = re.compile(r"[0-9]")
+
+# First recognition with its intent/slots (None if not recognized)
+_RecognitionResult = typing.Tuple[
+    Recognition, Intent, typing.List[Slot], typing.List[AsrToken]
+]
+
 # -----------------------------------------------------------------------------
 
 
+def _passes_filter(
+    result: typing.Optional[_RecognitionResult], intent_names: typing.FrozenSet[str]
+) -> bool:
+    """True if an unfiltered result also holds under an intent filter."""
+    return (result is not None) and (result[1].intent_name in intent_names)
+
+
 class NluHermesMqtt(HermesClient):
     """Hermes MQTT server for Rhasspy fuzzywuzzy."""
 
@@ -35,6 +65,7 @@ class NluHermesMqtt(HermesClient):
         client,
         intent_graph: typing.Optional[nx.DiGraph] = None,
         intent_graph_path: typing.Optional[Path] = None,
+        examples: typing.Optional[ExamplesType] = None,
         examples_path: typing.Optional[Path] = None,
         sentences: typing.Optional[typing.List[Path]] = None,
         default_entities: typing.Dict[str, typing.Iterable[Sentence]] = None,
@@ -56,9 +87,16 @@ class NluHermesMqtt(HermesClient):
         self.intent_graph = intent_graph
         self.intent_graph_path = intent_graph_path
 
+        # Digest of the graph file examples were last trained from
+        self.graph_digest: typing.Optional[str] = None
+
         # Examples
+        self.examples = examples
         self.examples_path = examples_path
 
+        # Unique example sentences (for exact matches and scoring)
+        self.example_index: typing.Optional[_rapid.ExampleIndexType] = None
+
         self.sentences = sentences or []
         self.default_entities = default_entities or {}
         self.word_transform = word_transform
@@ -66,6 +104,16 @@ class NluHermesMqtt(HermesClient):
         self.replace_numbers = replace_numbers
         self.language = language
 
+        # Memoized per-query/per-token text transforms
+        self._word_transform_cached = (
+            functools.lru_cache(maxsize=4096)(self.word_transform)
+            if self.word_transform
+            else None
+        )
+        self._replace_number_cached = functools.lru_cache(maxsize=4096)(
+            self._replace_number
+        )
+
         # Minimum confidence before not recognized
         self.confidence_threshold = confidence_threshold
 
@@ -73,102 +121,147 @@ class NluHermesMqtt(HermesClient):
 
         self.lang = lang
 
+        # Cache of recent recognitions (LRU)
+        self._recog_cache: OrderedDict = OrderedDict()
+        self._recog_cache_max = 128
+
+        self.load_artifacts()
+
     # -------------------------------------------------------------------------
 
-    async def handle_query(
-        self, query: NluQuery
-    ) -> typing.AsyncIterable[
-        typing.Union[
-            NluIntentParsed,
-            typing.Tuple[NluIntent, TopicArgs],
-            NluIntentNotRecognized,
-            NluError,
-        ]
-    ]:
-        """Do intent recognition."""
-        # Check intent graph
+    def load_artifacts(self):
+        """Load intent graph and examples from disk if not already loaded."""
         try:
             if (
-                not self.intent_graph
+                (self.intent_graph is None)
                 and self.intent_graph_path
                 and self.intent_graph_path.is_file()
             ):
                 _LOGGER.debug("Loading %s", self.intent_graph_path)
-                with open(self.intent_graph_path, mode="rb") as graph_file:
-                    self.intent_graph = rhasspynlu.gzip_pickle_to_graph(graph_file)
+                self.intent_graph = read_graph(self.intent_graph_path)
 
-            # Check examples
             if (
-                self.intent_graph
+                (self.intent_graph is not None)
+                and (self.examples is None)
                 and self.examples_path
                 and self.examples_path.is_file()
             ):
+                _LOGGER.debug("Loading %s", self.examples_path)
+                self.examples = read_examples(self.examples_path, self.intent_graph)
 
-                def intent_filter(intent_name: str) -> bool:
-                    """Filter out intents."""
-                    if query.intent_filter:
-                        return intent_name in query.intent_filter
-                    return True
-
-                original_text = query.input
+            if (self.examples is not None) and (self.example_index is None):
+                self.example_index = _rapid.index_examples(self.examples)
+        except Exception:
+            _LOGGER.exception("load_artifacts")
 
-                # Replace digits with words
-                if self.replace_numbers:
-                    # Have to assume whitespace tokenization
-                    words = rhasspynlu.replace_numbers(
-                        query.input.split(), self.language
-                    )
-                    query.input = " ".join(words)
+    # -------------------------------------------------------------------------
 
-                input_text = query.input
+    async def handle_query(
+        self, query: NluQuery
+    ) -> typing.AsyncIterable[
+        typing.Union[
+            NluIntentParsed,
+            typing.Tuple[NluIntent, TopicArgs],
+            NluIntentNotRecognized,
+            NluError,
+        ]
+    ]:
+        """Do intent recognition."""
+        original_text = query.input
 
-                # Fix casing
-                if self.word_transform:
-                    input_text = self.word_transform(input_text)
+        # Ids are copied into every reply and topic
+        if query.site_id:
+            query.site_id = sys.intern(query.site_id)
 
-                recognitions: typing.List[rhasspynlu.intent.Recognition] = []
+        if query.session_id:
+            query.session_id = sys.intern(query.session_id)
 
-                if input_text:
-                    recognitions = rhasspyfuzzywuzzy.recognize(
-                        input_text,
-                        self.intent_graph,
-                        str(self.examples_path),
-                        intent_filter=intent_filter,
-                        extra_converters=self.extra_converters,
-                    )
-            else:
+        try:
+            if (self.intent_graph is None) or (self.examples is None):
                 _LOGGER.error("No intent graph or examples loaded")
-                recognitions = []
-
-            # Use first recognition only if above threshold
-            if (
-                recognitions
-                and recognitions[0]
-                and recognitions[0].intent
-                and (recognitions[0].intent.confidence >= self.confidence_threshold)
-            ):
-                recognition = recognitions[0]
-                assert recognition.intent
-                intent = Intent(
-                    intent_name=recognition.intent.name,
-                    confidence_score=recognition.intent.confidence,
+                yield NluError(
+                    site_id=query.site_id,
+                    session_id=query.session_id,
+                    error="No intent graph or examples loaded",
+                    context=original_text,
                 )
-                slots = [
-                    Slot(
-                        entity=(e.source or e.entity),
-                        slot_name=e.entity,
-                        confidence=1.0,
-                        value=e.value_dict,
-                        raw_value=e.raw_value,
-                        range=SlotRange(
-                            start=e.start,
-                            end=e.end,
-                            raw_start=e.raw_start,
-                            raw_end=e.raw_end,
+                return
+
+            # Filter out intents (None allows all)
+            intent_names = (
+                frozenset(query.intent_filter) if query.intent_filter else None
+            )
+            intent_filter = intent_names.__contains__ if intent_names else None
+
+            # Replace digits with words
+            if self.replace_numbers:
+                # Have to assume whitespace tokenization
+                words = query.input.split()
+
+                # Only look at individual words if there are any digits
+                if _DIGITS.search(query.input):
+                    words = [
+                        number_word
+                        for word in words
+                        for number_word in self._replace_number_cached(word)
+                    ]
+
+                query.input = " ".join(words)
+
+            input_text = query.input
+
+            # Fix casing
+            if self._word_transform_cached:
+                input_text = self._word_transform_cached(input_text)
+
+            result: typing.Optional[_RecognitionResult] = None
+
+            if input_text:
+                cache_key = (input_text, intent_names)
+                unfiltered_key = (input_text, None)
+                if cache_key in self._recog_cache:
+                    self._recog_cache.move_to_end(cache_key)
+                    result = self._recog_cache[cache_key]
+                elif (
+                    intent_names
+                    and (unfiltered_key in self._recog_cache)
+                    and _passes_filter(self._recog_cache[unfiltered_key], intent_names)
+                ):
+                    # Best match over all intents is also the best one within
+                    # the filter. A failed match is never reused: the filtered
+                    # query scores different candidates.
+                    self._recog_cache.move_to_end(unfiltered_key)
+                    result = self._recog_cache[unfiltered_key]
+                else:
+                    # Score off the event loop
+                    examples, example_index = self.examples, self.example_index
+                    recognitions = await asyncio.get_running_loop().run_in_executor(
+                        None,
+                        functools.partial(
+                            _rapid.recognize,
+                            input_text,
+                            self.intent_graph,
+                            examples,
+                            intent_filter=intent_filter,
+                            extra_converters=self.extra_converters,
+                            score_cutoff=self._score_cutoff(),
+                            example_index=example_index,
                         ),
                     )
-                    for e in recognition.entities
-                ]
+
+                    result = self._recognition_result(recognitions)
+
+                    # Don't cache results from before a re-train
+                    if examples is self.examples:
+                        self._recog_cache[cache_key] = result
+                        if len(self._recog_cache) > self._recog_cache_max:
+                            self._recog_cache.popitem(last=False)
+
+            if result:
+                recognition, intent, cached_slots, cached_asr_tokens = result
+
+                # Slots/tokens are shared with the cache, but the lists are not
+                slots = list(cached_slots)
 
                 if query.custom_entities:
                     # Copy user-defined entities
@@ -200,14 +293,14 @@ class NluHermesMqtt(HermesClient):
                         session_id=query.session_id,
                         intent=intent,
                         slots=slots,
-                        asr_tokens=[NluIntent.make_asr_tokens(recognition.tokens)],
+                        asr_tokens=[list(cached_asr_tokens)],
                         asr_confidence=query.asr_confidence,
                         raw_input=original_text,
                         wakeword_id=query.wakeword_id,
                         lang=(query.lang or self.lang),
                         custom_data=query.custom_data,
                     ),
-                    {"intent_name": recognition.intent.name},
+                    {"intent_name": intent.intent_name},
                 )
             else:
                 # Not recognized
@@ -227,6 +320,63 @@ class NluHermesMqtt(HermesClient):
                 context=original_text,
             )
 
+    def _recognition_result(
+        self, recognitions: typing.List[Recognition]
+    ) -> typing.Optional[_RecognitionResult]:
+        """Convert first recognition to intent/slots/ASR tokens if above threshold."""
+        if not (
+            recognitions
+            and recognitions[0]
+            and recognitions[0].intent
+            and (recognitions[0].intent.confidence >= self.confidence_threshold)
+        ):
+            return None
+
+        recognition = recognitions[0]
+        assert recognition.intent
+        intent = Intent(
+            intent_name=sys.intern(recognition.intent.name),
+            confidence_score=recognition.intent.confidence,
+        )
+        slots = [
+            Slot(
+                entity=(e.source or e.entity),
+                slot_name=e.entity,
+                confidence=1.0,
+                value=e.value_dict,
+                raw_value=e.raw_value,
+                range=SlotRange(
+                    start=e.start, end=e.end, raw_start=e.raw_start, raw_end=e.raw_end
+                ),
+            )
+            for e in recognition.entities
+        ]
+
+        return (
+            recognition,
+            intent,
+            slots,
+            NluIntent.make_asr_tokens(recognition.tokens),
+        )
+
+    def _score_cutoff(self) -> float:
+        """Minimum rapidfuzz score (0-100) that could pass the confidence threshold."""
+        # Slightly lower to absorb float error (0.7 * 100 > 70).
+        # The threshold itself is still checked in _recognition_result.
+        return max(0.0, (self.confidence_threshold * 100) - 1e-6)
+
+    def _warm_up(self):
+        """Score a dummy query against all examples (result is ignored)."""
+        try:
+            if self.example_index is not None:
+                _rapid.warm_up(self.example_index)
+        except Exception:
+            _LOGGER.debug("Warm up failed", exc_info=True)
+
+    def _replace_number(self, word: str) -> typing.Tuple[str, ...]:
+        """Replace a single token with words if it's a number."""
+        return tuple(rhasspynlu.replace_numbers([word], self.language))
+
     # -------------------------------------------------------------------------
 
     async def handle_train(
@@ -236,34 +386,18 @@ class NluHermesMqtt(HermesClient):
     ]:
         """Transform sentences to intent examples"""
         try:
-            _LOGGER.debug("Loading %s", train.graph_path)
-            with open(train.graph_path, mode="rb") as graph_file:
-                self.intent_graph = rhasspynlu.gzip_pickle_to_graph(graph_file)
-
-            examples = rhasspyfuzzywuzzy.train(self.intent_graph)
-
-            if self.examples_path:
-                if self.examples_path.is_file():
-                    # Delete existing file
-                    self.examples_path.unlink()
-
-                # Write examples to SQLite database
-                conn = sqlite3.connect(str(self.examples_path))
-                c = conn.cursor()
-                c.execute("""DROP TABLE IF EXISTS intents""")
-                c.execute("""CREATE TABLE intents (sentence text, path text)""")
-
-                for _, sentences in examples.items():
-                    for sentence, path in sentences.items():
-                        c.execute(
-                            "INSERT INTO intents VALUES (?, ?)",
-                            (sentence, json.dumps(path, ensure_ascii=False)),
-                        )
+            loop = asyncio.get_running_loop()
+
+            # Skip training if the graph file hasn't changed since last time
+            graph_path = Path(train.graph_path)
+            graph_digest = await loop.run_in_executor(None, file_digest, graph_path)
 
-                conn.commit()
-                conn.close()
+            if (graph_digest == self.graph_digest) and (self.examples is not None):
+                _LOGGER.debug("Intent graph unchanged, skipping training")
+            else:
+                await self._train(loop, graph_path)
+                self.graph_digest = graph_digest
 
-                _LOGGER.debug("Wrote %s", str(self.examples_path))
             yield (NluTrainSuccess(id=train.id), {"site_id": site_id})
         except Exception as e:
             _LOGGER.exception("handle_train")
@@ -273,6 +407,81 @@ class NluHermesMqtt(HermesClient):
 
     # -------------------------------------------------------------------------
 
+    async def _train(self, loop: asyncio.AbstractEventLoop, graph_path: Path):
+        """Load graph, generate examples, and swap them in."""
+        # Load graph, train, and write examples off the event loop
+        _LOGGER.debug("Loading %s", graph_path)
+        intent_graph = await loop.run_in_executor(None, read_graph, graph_path)
+
+        examples = await loop.run_in_executor(None, _rapid.train, intent_graph)
+
+        example_index = await loop.run_in_executor(
+            None, _rapid.index_examples, examples
+        )
+
+        if self.examples_path:
+            await loop.run_in_executor(
+                None, write_examples, self.examples_path, examples
+            )
+            _LOGGER.debug("Wrote %s", str(self.examples_path))
+
+        self.intent_graph = intent_graph
+        self.examples = examples
+        self.example_index = example_index
+        self._recog_cache.clear()
+
+        # Score a throwaway query in the background so the first real
+        # query doesn't pay for cold caches.
+        loop.run_in_executor(None, self._warm_up)
+
+    # -------------------------------------------------------------------------
+
+    def publish(self, message: Message, **topic_args):
+        """Publish a Hermes message to MQTT with a fast JSON encoder."""
+        if message.is_binary_payload():
+            super().publish(message, **topic_args)
+            return
+
+        try:
+            topic = message.topic(**topic_args)
+
+            if isinstance(message, NluIntentNotRecognized):
+                # Most common reply, and all fields are simple values
+                payload = (
+                    b'{"input":%s,"siteId":%s,"id":%s,"customData":%s,"sessionId":%s}'
+                    % (
+                        json_dumps(message.input),
+                        json_dumps(message.site_id),
+                        json_dumps(message.id),
+                        json_dumps(message.custom_data),
+                        json_dumps(message.session_id),
+                    )
+                )
+            else:
+                payload = json_dumps(message_to_dict(message))
+
+            _LOGGER.debug("-> %s", message)
+            _LOGGER.debug("Publishing %s bytes(s) to %s", len(payload), topic)
+            self.mqtt_client.publish(topic, payload)
+        except Exception:
+            _LOGGER.exception(
+                "publish (message=%s, topic_args=%s)",
+                message.__class__.__name__,
+                topic_args,
+            )
+
+    def mqtt_on_connect(self, client, userdata, flags, rc):
+        """Disable Nagle's algorithm so back-to-back replies go out immediately."""
+        try:
+            client.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (AttributeError, OSError):
+            # Websocket transport, etc.
+            _LOGGER.debug("Unable to set TCP_NODELAY on MQTT socket")
+
+        super().mqtt_on_connect(client, userdata, flags, rc)
+
+    # -------------------------------------------------------------------------
+
     async def on_message(
         self,
         message: Message,
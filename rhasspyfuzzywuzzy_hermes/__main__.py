@@ -71,6 +71,7 @@ def main():
         client,
         intent_graph_path=args.intent_graph,
         examples_path=args.examples,
+        word_transform=get_word_transform(args.casing),
         replace_numbers=args.replace_numbers,
         language=args.language,
         confidence_threshold=args.confidence_threshold,
@@ -83,6 +84,14 @@ def main():
     hermes_cli.connect(client, args)
     client.loop_start()
 
+    try:
+        # Faster event loop if available
+        import uvloop
+
+        uvloop.install()
+    except ImportError:
+        pass
+
     try:
         # Run event loop
         asyncio.run(hermes.handle_messages_async())
@@ -96,15 +105,15 @@ def main():
 # -----------------------------------------------------------------------------
 
 
-def get_word_transform(name: str) -> typing.Callable[[str], str]:
-    """Gets a word transformation function by name."""
-    if name == "upper":
-        return str.upper
+_WORD_TRANSFORMS: typing.Dict[str, typing.Callable[[str], str]] = {
+    "upper": str.upper,
+    "lower": str.lower,
+}
 
-    if name == "lower":
-        return str.lower
 
-    return lambda s: s
+def get_word_transform(name: str) -> typing.Optional[typing.Callable[[str], str]]:
+    """Gets a word transformation function by name (None for "ignore")."""
+    return _WORD_TRANSFORMS.get(name)
 
 
 # -----------------------------------------------------------------------------
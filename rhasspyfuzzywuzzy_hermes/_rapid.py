@@ -0,0 +1,319 @@
+"""Training and intent recognition with rapidfuzz against in-memory examples"""
+import logging
+import sys
+import time
+import typing
+from collections import defaultdict
+
+import networkx as nx
+import rapidfuzz.fuzz as fuzz
+import rapidfuzz.process as fuzzy_process
+import rapidfuzz.utils as fuzz_utils
+import rhasspynlu
+from rhasspyfuzzywuzzy.const import ExamplesType
+from rhasspynlu.intent import Recognition
+
+_LOGGER = logging.getLogger("rhasspyfuzzywuzzy_hermes")
+
+# Highest WRatio possible for different strings via token ratios, and for
+# strings whose lengths differ by 1.5x / 8x (plus a little slack for float error)
+_MAX_TOKEN_SCORE = 95.0 + 1e-6
+_MAX_PARTIAL_SCORE = 90.0 + 1e-6
+_MAX_FAR_PARTIAL_SCORE = 60.0 + 1e-6
+
+# Parallel arrays (structure of arrays) indexed by sentence number:
+# (unique sentences, intent names of each sentence, sentence -> index).
+#
+# Scoring a query is bound by walking the choice strings, not by arithmetic
+# (rapidfuzz's kernels are bit-parallel), so the index keeps sentences in one
+# flat list that is handed to rapidfuzz as-is.
+ExampleIndexType = typing.Tuple[
+    typing.List[str], typing.List[typing.Tuple[str, ...]], typing.Dict[str, int]
+]
+
+# -----------------------------------------------------------------------------
+
+
+def train(intent_graph: nx.DiGraph) -> ExamplesType:
+    """Generate examples from intent graph (drop-in for rhasspyfuzzywuzzy.train)."""
+    _LOGGER.debug("Generating examples")
+    examples: ExamplesType = defaultdict(dict)
+
+    # Sentences are processed here once so queries only process their own text.
+    # They're interned so sentences shared between intents (and the token
+    # index built from them) refer to a single string object.
+    for intent_name, _words, text, path in generate_examples(intent_graph):
+        examples[intent_name][sys.intern(fuzz_utils.default_process(text))] = path
+
+    _LOGGER.debug("Examples generated")
+
+    return examples
+
+
+def generate_examples(
+    intent_graph: nx.DiGraph,
+) -> typing.Iterable[typing.Tuple[str, typing.List[str], str, typing.List[int]]]:
+    """Generate all possible (intent, words, sentence, path) from an intent graph."""
+    # Get start/end nodes for graph
+    start_node, end_node = rhasspynlu.jsgf_graph.get_start_end_nodes(intent_graph)
+    assert (start_node is not None) and (
+        end_node is not None
+    ), "Missing start/end node(s)"
+
+    # Plain dicts avoid networkx view lookups for every node of every path
+    node_words = {
+        node: data.get("word") for node, data in intent_graph.nodes(data=True)
+    }
+
+    # First edge has intent name (__label__INTENT).
+    # Names are interned since they're shared by every example of an intent.
+    start_intents: typing.Dict[typing.Any, typing.Optional[str]] = {}
+    for _, next_node, data in intent_graph.out_edges(start_node, data=True):
+        olabel = data.get("olabel", "")
+        start_intents[next_node] = (
+            sys.intern(olabel[9:]) if olabel.startswith("__label__") else None
+        )
+
+    # Generate all sentences/paths
+    for path, words in _simple_paths(intent_graph, start_node, end_node, node_words):
+        assert len(path) > 2
+
+        intent_name = start_intents[path[1]]
+        assert intent_name is not None, "Missing __label__ on first edge"
+
+        yield (intent_name, words, " ".join(words), path)
+
+
+def _simple_paths(
+    intent_graph: nx.DiGraph,
+    start_node: typing.Any,
+    end_node: typing.Any,
+    node_words: typing.Dict[typing.Any, typing.Optional[str]],
+) -> typing.Iterable[typing.Tuple[typing.List[typing.Any], typing.List[str]]]:
+    """Yield (path, words) in the same order as nx.all_simple_paths.
+
+    Words are pushed/popped along with the depth-first search instead of being
+    looked up again for every complete path.
+    """
+    if start_node == end_node:
+        return
+
+    adj = intent_graph.adj
+    end_word = node_words[end_node]
+
+    path = [start_node]
+    on_path = {start_node}
+    start_word = node_words[start_node]
+    words = [start_word] if start_word else []
+    has_word = [bool(start_word)]
+    stack = [iter(adj[start_node])]
+
+    while stack:
+        child = next(stack[-1], None)
+        if child is None:
+            stack.pop()
+            on_path.discard(path.pop())
+            if has_word.pop():
+                words.pop()
+        elif child == end_node:
+            # Never extend a path past the end node
+            yield (path + [child], words + [end_word] if end_word else words[:])
+        elif child not in on_path:
+            path.append(child)
+            on_path.add(child)
+            child_word = node_words[child]
+            has_word.append(bool(child_word))
+            if child_word:
+                words.append(child_word)
+
+            stack.append(iter(adj[child]))
+
+
+def index_examples(examples: ExamplesType) -> ExampleIndexType:
+    """Flatten examples into unique sentences and the intents of each."""
+    sentences: typing.List[str] = []
+    sentence_intents: typing.List[typing.List[str]] = []
+
+    # Sentence -> index for exact matches (shared sentences are stored once)
+    sentence_idxs: typing.Dict[str, int] = {}
+
+    for intent_name, intent_sentences in examples.items():
+        for sentence in intent_sentences:
+            sentence_idx = sentence_idxs.get(sentence)
+            if sentence_idx is not None:
+                sentence_intents[sentence_idx].append(intent_name)
+                continue
+
+            sentence_idx = len(sentences)
+            sentence_idxs[sentence] = sentence_idx
+            sentences.append(sentence)
+            sentence_intents.append([intent_name])
+
+    return (sentences, [tuple(names) for names in sentence_intents], sentence_idxs)
+
+
+def _prune_by_length(
+    query_text: str,
+    sentence_idxs: typing.Sequence[int],
+    choices: typing.Sequence[str],
+    score_cutoff: float,
+) -> typing.Tuple[typing.Sequence[int], typing.Sequence[str]]:
+    """Keep only choices whose length allows a WRatio of at least score_cutoff.
+
+    WRatio only uses plain ratio/token ratios when lengths differ by less than
+    1.5x. Beyond that, the best it can do is a partial match scaled to 90, or
+    to 60 once lengths differ by more than 8x. Above 95, only the plain ratio
+    is left, which is at most 100 - 100 / (total length) for different
+    strings, so a cutoff of 100 leaves nothing but exact matches.
+    """
+    query_len = len(query_text)
+    if score_cutoff > _MAX_TOKEN_SCORE:
+        # Long enough for a single edit to stay above the cutoff
+        min_total_len = 100.0 / (100.0 - score_cutoff + 1e-6)
+        kept = [
+            (sentence_idx, choice)
+            for sentence_idx, choice in zip(sentence_idxs, choices)
+            if (query_len + len(choice)) >= min_total_len
+            and 2 * max(query_len, len(choice)) < 3 * min(query_len, len(choice))
+        ]
+    elif score_cutoff > _MAX_PARTIAL_SCORE:
+        # Within 1.5x
+        kept = [
+            (sentence_idx, choice)
+            for sentence_idx, choice in zip(sentence_idxs, choices)
+            if 2 * max(query_len, len(choice)) < 3 * min(query_len, len(choice))
+        ]
+    elif score_cutoff > _MAX_FAR_PARTIAL_SCORE:
+        # Within 8x
+        kept = [
+            (sentence_idx, choice)
+            for sentence_idx, choice in zip(sentence_idxs, choices)
+            if max(query_len, len(choice)) <= 8 * min(query_len, len(choice))
+        ]
+    else:
+        return (sentence_idxs, choices)
+
+    return ([k[0] for k in kept], [k[1] for k in kept])
+
+
+def _extract_best(
+    query_text: str, choices: typing.Sequence[str]
+) -> typing.Optional[typing.Tuple[int, float]]:
+    """Get index and score of best matching choice (first one on ties)."""
+    if not choices:
+        return None
+
+    # No score_cutoff: rapidfuzz 0.13's WRatio scores lower when given one
+    result = fuzzy_process.extractOne(
+        query_text, choices, scorer=fuzz.WRatio, processor=None
+    )
+
+    if not result:
+        return None
+
+    return (result[2], result[1])
+
+
+# -----------------------------------------------------------------------------
+
+
+def warm_up(example_index: ExampleIndexType):
+    """Score a dummy query against all example sentences (result is ignored)."""
+    # No recognition is built, so converters never run
+    _extract_best("warm up", example_index[0])
+
+
+def recognize(
+    input_text: str,
+    intent_graph: nx.DiGraph,
+    examples: ExamplesType,
+    intent_filter: typing.Optional[typing.Callable[[str], bool]] = None,
+    extra_converters: typing.Optional[
+        typing.Dict[str, typing.Callable[..., typing.Any]]
+    ] = None,
+    score_cutoff: float = 0.0,
+    example_index: typing.Optional[ExampleIndexType] = None,
+) -> typing.List[Recognition]:
+    """Find the closest matching intent (drop-in for rhasspyfuzzywuzzy.recognize)."""
+    start_time = time.perf_counter()
+    intent_filter = intent_filter or (lambda i: True)
+
+    # Examples are processed during training, so only process the query
+    query_text = fuzz_utils.default_process(input_text)
+
+    best_intent: typing.Optional[str] = None
+    best_text = ""
+    best_score = 0.0
+
+    if example_index is None:
+        example_index = index_examples(examples)
+
+    sentences, sentence_intents, exact_idxs = example_index
+
+    # Exact match can't be beaten, so skip scoring (one hash lookup)
+    exact_idx = exact_idxs.get(query_text)
+    if exact_idx is not None:
+        best_intent = next(
+            (name for name in sentence_intents[exact_idx] if intent_filter(name)), None
+        )
+        if best_intent is not None:
+            best_text, best_score = query_text, 100.0
+
+    if best_intent is None:
+        allowed_intents = {
+            intent_name for intent_name in examples if intent_filter(intent_name)
+        }
+
+        # Keep training order so ties are broken the same way
+        sentence_idxs: typing.Sequence[int]
+        choices: typing.Sequence[str]
+        if len(allowed_intents) == len(examples):
+            # Score all examples using the list built at training time
+            sentence_idxs = range(len(sentences))
+            choices = sentences
+        else:
+            sentence_idxs = [
+                i
+                for i, intent_names in enumerate(sentence_intents)
+                if not allowed_intents.isdisjoint(intent_names)
+            ]
+            choices = [sentences[i] for i in sentence_idxs]
+
+        if score_cutoff > _MAX_FAR_PARTIAL_SCORE:
+            # Drop choices whose length alone rules out reaching the cutoff.
+            # The cutoff is only used here, never passed to the scorer.
+            sentence_idxs, choices = _prune_by_length(
+                query_text, sentence_idxs, choices, score_cutoff
+            )
+
+        # Confidence threshold is checked by the caller
+        result = _extract_best(query_text, choices)
+
+        if result:
+            sentence_idx = sentence_idxs[result[0]]
+            best_text, best_score = sentences[sentence_idx], result[1]
+            best_intent = next(
+                intent_name
+                for intent_name in sentence_intents[sentence_idx]
+                if intent_name in allowed_intents
+            )
+
+    _LOGGER.debug("input=%s, match=%s, score=%s", input_text, best_text, best_score)
+
+    if best_intent is None:
+        return []
+
+    best_path = examples[best_intent][best_text]
+
+    end_time = time.perf_counter()
+    _, recognition = rhasspynlu.fsticuffs.path_to_recognition(
+        best_path, intent_graph, extra_converters=extra_converters
+    )
+
+    assert recognition and recognition.intent, "Failed to find a match"
+    recognition.intent.confidence = best_score / 100.0
+    recognition.recognize_seconds = end_time - start_time
+    recognition.raw_text = input_text
+    recognition.raw_tokens = input_text.split()
+
+    return [recognition]
@@ -1,13 +1,81 @@
 """Utility methods for rhasspy-fuzzywuzzy-hermes"""
-import io
+import dataclasses
+import functools
+import hashlib
 import json
 import logging
+import mmap
+import os
+import pickle
+import sqlite3
 import subprocess
+import sys
 import typing
+from collections import defaultdict
 from pathlib import Path
 
+import networkx as nx
+from rhasspyfuzzywuzzy.const import ExamplesType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore
+
+try:
+    from isal.isal_zlib import decompress as zlib_decompress
+except ImportError:
+    from zlib import decompress as zlib_decompress  # type: ignore
+
 _LOGGER = logging.getLogger("rhasspyfuzzywuzzy_hermes")
 
+# -----------------------------------------------------------------------------
+
+
+def json_dumps(value: typing.Any) -> bytes:
+    """Serialize value to compact UTF-8 JSON (uses orjson if available)"""
+    if orjson is not None:
+        return orjson.dumps(value)
+
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def json_loads(data: typing.Union[str, bytes]) -> typing.Any:
+    """Deserialize JSON (uses orjson if available)"""
+    if orjson is not None:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+@functools.lru_cache(maxsize=64)
+def _dataclass_keys(cls: type) -> typing.Tuple[typing.Tuple[str, str], ...]:
+    """Get (field name, JSON key) pairs for a dataclass_json class"""
+    config = getattr(cls, "dataclass_json_config", None) or {}
+    letter_case = config.get("letter_case")
+
+    return tuple(
+        (field.name, letter_case(field.name) if letter_case else field.name)
+        for field in dataclasses.fields(cls)
+    )
+
+
+def message_to_dict(value: typing.Any) -> typing.Any:
+    """Convert a Hermes message to a JSON-compatible dict without deep copies"""
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        return {
+            key: message_to_dict(getattr(value, name))
+            for name, key in _dataclass_keys(type(value))
+        }
+
+    if isinstance(value, dict):
+        return {k: message_to_dict(v) for k, v in value.items()}
+
+    if isinstance(value, (list, tuple, set)):
+        return [message_to_dict(v) for v in value]
+
+    return value
+
 
 # -----------------------------------------------------------------------------
 
@@ -19,27 +87,28 @@ class CliConverter:
         self.name = name
         self.command_path = command_path
 
+        # Converters read all of stdin until EOF, so a new process is needed
+        # per call. Resolve the command once instead.
+        self.command = [str(command_path)]
+
     def __call__(self, *args, converter_args=None):
         """Runs external program to convert JSON values"""
-        converter_args = converter_args or []
-        proc = subprocess.Popen(
-            [str(self.command_path)] + converter_args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            universal_newlines=True,
-        )
+        command = self.command + converter_args if converter_args else self.command
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
 
-        with io.StringIO() as input_file:
-            if len(args) == 1:
-                # Single value
-                json.dump(args[0], input_file)
-            elif len(args) > 1:
-                # Multiple values as list
-                json.dump(args, input_file)
+        # JSON is exchanged as UTF-8 bytes without text decoding
+        if len(args) == 1:
+            # Single value
+            input_bytes = json_dumps(args[0])
+        elif len(args) > 1:
+            # Multiple values as list
+            input_bytes = json_dumps(args)
+        else:
+            input_bytes = b""
 
-            stdout, _ = proc.communicate(input=input_file.getvalue())
+        stdout, _ = proc.communicate(input=input_bytes)
 
-            return [json.loads(line) for line in stdout.splitlines() if line.strip()]
+        return [json_loads(line) for line in stdout.splitlines() if line.strip()]
 
 
 def load_converters(converters_dir: Path,) -> typing.Dict[str, typing.Any]:
@@ -48,23 +117,109 @@ def load_converters(converters_dir: Path,) -> typing.Dict[str, typing.Any]:
 
     if converters_dir.is_dir():
         _LOGGER.debug("Loading converters from %s", converters_dir)
-        for converter_path in converters_dir.glob("**/*"):
-            if not converter_path.is_file():
-                continue
 
-            # Retain directory structure in name
-            converter_name = str(
-                converter_path.relative_to(converters_dir).with_suffix("")
-            )
+        # Scan with plain strings; a Path is only built for each converter.
+        # DirEntry file types come from the directory listing, so regular
+        # files don't need a stat call each.
+        dir_paths = [str(converters_dir)]
+        while dir_paths:
+            with os.scandir(dir_paths.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        # Like glob("**"), don't descend into linked dirs
+                        dir_paths.append(entry.path)
+                        continue
+
+                    if not entry.is_file():
+                        # Broken symlink, etc.
+                        continue
+
+                    # Retain directory structure in name
+                    converter_name = os.path.splitext(
+                        os.path.relpath(entry.path, converters_dir)
+                    )[0]
+
+                    # Run converter as external program.
+                    # Input arguments are encoded as JSON on individual lines.
+                    # Output values should be encoded as JSON on individual lines.
+                    converter = CliConverter(converter_name, Path(entry.path))
+
+                    # Key off name without file extension
+                    converters[converter_name] = converter
+
+                    _LOGGER.debug(
+                        "Loaded converter %s from %s", converter_name, entry.path
+                    )
+
+    return converters
 
-            # Run converter as external program.
-            # Input arguments are encoded as JSON on individual lines.
-            # Output values should be encoded as JSON on individual lines.
-            converter = CliConverter(converter_name, converter_path)
 
-            # Key off name without file extension
-            converters[converter_name] = converter
+# -----------------------------------------------------------------------------
 
-            _LOGGER.debug("Loaded converter %s from %s", converter_name, converter_path)
 
-    return converters
+def read_examples(examples_path: Path, intent_graph: nx.DiGraph) -> ExamplesType:
+    """Load training examples from a SQLite database into memory"""
+    examples: ExamplesType = defaultdict(dict)
+
+    # Read-only, memory-mapped scan of the whole table
+    conn = sqlite3.connect(f"{examples_path.absolute().as_uri()}?mode=ro", uri=True)
+    try:
+        conn.execute("PRAGMA mmap_size=268435456")
+        for sentence, path_json in conn.execute(
+            "SELECT sentence, path FROM intents ORDER BY rowid"
+        ):
+            path = json_loads(path_json)
+
+            # First edge has intent name (__label__INTENT)
+            olabel = intent_graph.edges[(path[0], path[1])]["olabel"]
+            examples[sys.intern(olabel[9:])][sys.intern(sentence)] = path
+    finally:
+        conn.close()
+
+    return examples
+
+
+def write_examples(examples_path: Path, examples: ExamplesType):
+    """Write training examples to a new SQLite database"""
+    if examples_path.is_file():
+        # Delete existing file
+        examples_path.unlink()
+
+    conn = sqlite3.connect(str(examples_path))
+
+    # Database is rebuilt from scratch, so skip journaling/fsync
+    conn.execute("PRAGMA journal_mode=MEMORY")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+    rows = (
+        (sentence, json_dumps(path).decode())
+        for sentences in examples.values()
+        for sentence, path in sentences.items()
+    )
+
+    try:
+        with conn:
+            conn.execute("""DROP TABLE IF EXISTS intents""")
+            conn.execute("""CREATE TABLE intents (sentence text, path text)""")
+            conn.executemany("INSERT INTO intents VALUES (?, ?)", rows)
+    finally:
+        conn.close()
+
+
+def file_digest(file_path: Path) -> str:
+    """Get the blake2b digest of a file's contents"""
+    digest = hashlib.blake2b()
+    with open(file_path, mode="rb") as input_file:
+        for chunk in iter(lambda: input_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def read_graph(graph_path: Path) -> nx.DiGraph:
+    """Load intent graph from a gzipped pickle (decompressed in one pass)"""
+    with open(graph_path, mode="rb") as graph_file:
+        with mmap.mmap(graph_file.fileno(), 0, access=mmap.ACCESS_READ) as graph_buffer:
+            # wbits=31 expects a gzip header
+            return pickle.loads(zlib_decompress(graph_buffer, wbits=31))
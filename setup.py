@@ -29,6 +29,7 @@ setuptools.setup(
     url="https://github.com/rhasspy/rhasspy-fuzzywuzzy-hermes",
     packages=setuptools.find_packages(),
     install_requires=requirements,
+    extras_require={"fast": ["isal", "orjson", "uvloop; platform_system != 'Windows'"]},
     entry_points={
         "console_scripts": [
             "rhasspy-fuzzywuzzy-hermes = rhasspyfuzzywuzzy_hermes.__main__:main"
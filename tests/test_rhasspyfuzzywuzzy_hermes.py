@@ -1,9 +1,11 @@
 """Unit tests for rhasspyfuzzwuzzy_hermes"""
 import asyncio
+import json
 import logging
+import socket
+import sys
 import tempfile
 import unittest
-import uuid
 from pathlib import Path
 from unittest.mock import MagicMock, patch
 
@@ -18,21 +20,73 @@ from rhasspyhermes.nlu import (
     NluTrain,
     NluTrainSuccess,
 )
-from rhasspynlu import intents_to_graph, parse_ini
+from rhasspynlu import graph_to_gzip_pickle, intents_to_graph, parse_ini
 
+import rhasspyfuzzywuzzy_hermes._rapid
+import rhasspyfuzzywuzzy_hermes.__main__
 from rhasspyfuzzywuzzy_hermes import NluHermesMqtt
 
 _LOGGER = logging.getLogger(__name__)
-_LOOP = asyncio.get_event_loop()
+
+# Fixed ids (only compared as strings)
+_SITE_ID = "test-site"
+_SESSION_ID = "test-session"
+_QUERY_ID = "test-query"
+_TRAIN_ID = "test-train"
+
+# Expected recognition of "set the bedroom light to red" (never mutated)
+_SET_LIGHT_COLOR_INTENT = Intent(intent_name="SetLightColor", confidence_score=1.0)
+_SET_LIGHT_COLOR_SLOTS = (
+    Slot(
+        entity="name",
+        slot_name="name",
+        value={"kind": "Unknown", "value": "bedroom"},
+        raw_value="bedroom",
+        confidence=1.0,
+        range=SlotRange(start=8, end=15, raw_start=8, raw_end=15),
+    ),
+    Slot(
+        entity="color",
+        slot_name="color",
+        value={"kind": "Unknown", "value": "red"},
+        raw_value="red",
+        confidence=1.0,
+        range=SlotRange(start=25, end=28, raw_start=25, raw_end=28),
+    ),
+)
+
+# Explicit loop: get_event_loop() without a running loop is deprecated, and
+# IsolatedAsyncioTestCase isn't available on Python 3.7.
+_LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(_LOOP)
+
+
+class _NullClient:
+    """MQTT client stand-in whose methods do nothing (cheaper than MagicMock)."""
+
+    @staticmethod
+    def _noop(*args, **kwargs):
+        return None
+
+    def __getattr__(self, name):
+        return _NullClient._noop
+
+
+def _payloads(results):
+    """Convert messages (or message/topic args pairs) to what goes over MQTT."""
+    return [
+        (result[0].__class__, result[0].to_dict(), result[1])
+        if isinstance(result, tuple)
+        else (result.__class__, result.to_dict())
+        for result in results
+    ]
 
 
 class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
     """Tests for rhasspyfuzzywuzzy_hermes"""
 
-    def setUp(self):
-        self.site_id = str(uuid.uuid4())
-        self.session_id = str(uuid.uuid4())
-
+    @classmethod
+    def setUpClass(cls):
         ini_text = """
         [SetLightColor]
         set the (bedroom | living room){name} light to (red | green | blue){color}
@@ -41,9 +95,25 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
         what time is it
         """
 
-        self.graph = intents_to_graph(parse_ini(ini_text))
-        self.examples = rhasspyfuzzywuzzy.train(self.graph)
-        self.client = MagicMock()
+        # Graph and examples are only read by the service, so share them
+        cls.graph = intents_to_graph(parse_ini(ini_text))
+        cls.examples = rhasspyfuzzywuzzy_hermes._rapid.train(cls.graph)
+
+        # Graph file written once for tests that train from disk
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.graph_path = Path(cls.temp_dir.name) / "intent_graph.pickle.gz"
+        with open(cls.graph_path, "wb") as graph_file:
+            graph_to_gzip_pickle(cls.graph, graph_file)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def setUp(self):
+        self.site_id = _SITE_ID
+        self.session_id = _SESSION_ID
+
+        self.client = _NullClient()
         self.hermes = NluHermesMqtt(
             self.client,
             self.graph,
@@ -56,64 +126,44 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
 
     async def async_test_handle_query(self):
         """Verify valid input leads to a query message."""
-        query_id = str(uuid.uuid4())
+        query_id = _QUERY_ID
         text = "set the bedroom light to red"
 
         query = NluQuery(
             input=text, id=query_id, site_id=self.site_id, session_id=self.session_id
         )
 
-        results = []
-        async for result in self.hermes.on_message(query):
-            results.append(result)
+        results = [result async for result in self.hermes.on_message(query)]
 
         # Check results
-        intent = Intent(intent_name="SetLightColor", confidence_score=1.0)
-        slots = [
-            Slot(
-                entity="name",
-                slot_name="name",
-                value={"kind": "Unknown", "value": "bedroom"},
-                raw_value="bedroom",
-                confidence=1.0,
-                range=SlotRange(start=8, end=15, raw_start=8, raw_end=15),
-            ),
-            Slot(
-                entity="color",
-                slot_name="color",
-                value={"kind": "Unknown", "value": "red"},
-                raw_value="red",
-                confidence=1.0,
-                range=SlotRange(start=25, end=28, raw_start=25, raw_end=28),
+        intent = _SET_LIGHT_COLOR_INTENT
+        slots = list(_SET_LIGHT_COLOR_SLOTS)
+
+        expected = [
+            NluIntentParsed(
+                input=text,
+                id=query_id,
+                site_id=self.site_id,
+                session_id=self.session_id,
+                intent=intent,
+                slots=slots,
             ),
-        ]
-
-        self.assertEqual(
-            results,
-            [
-                NluIntentParsed(
+            (
+                NluIntent(
                     input=text,
                     id=query_id,
                     site_id=self.site_id,
                     session_id=self.session_id,
                     intent=intent,
                     slots=slots,
+                    asr_tokens=[NluIntent.make_asr_tokens(text.split())],
+                    raw_input=text,
                 ),
-                (
-                    NluIntent(
-                        input=text,
-                        id=query_id,
-                        site_id=self.site_id,
-                        session_id=self.session_id,
-                        intent=intent,
-                        slots=slots,
-                        asr_tokens=[NluIntent.make_asr_tokens(text.split())],
-                        raw_input=text,
-                    ),
-                    {"intent_name": intent.intent_name},
-                ),
-            ],
-        )
+                {"intent_name": intent.intent_name},
+            ),
+        ]
+
+        self.assertEqual(_payloads(results), _payloads(expected))
 
     def test_handle_query(self):
         """Call async_test_handle_query."""
@@ -123,7 +173,7 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
 
     async def async_test_intent_filter(self):
         """Verify intent filter works."""
-        query_id = str(uuid.uuid4())
+        query_id = _QUERY_ID
         text = "what time is it"
 
         query = NluQuery(
@@ -131,9 +181,7 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
         )
 
         # Query should succeed
-        results = []
-        async for result in self.hermes.on_message(query):
-            results.append(result)
+        results = [result async for result in self.hermes.on_message(query)]
 
         # Check results
         self.assertEqual(len(results), 2)
@@ -144,7 +192,6 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
         self.assertEqual(nlu_intent.intent.intent_name, "GetTime")
 
         # Add intent filter
-        query_id = str(uuid.uuid4())
         query = NluQuery(
             input=text,
             id=query_id,
@@ -154,9 +201,7 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
         )
 
         # Query should fail
-        results = []
-        async for result in self.hermes.on_message(query):
-            results.append(result)
+        results = [result async for result in self.hermes.on_message(query)]
 
         # Check results
         self.assertEqual(len(results), 1)
@@ -170,62 +215,316 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
 
     async def async_test_not_recognized(self):
         """Verify invalid input leads to recognition failure."""
-        query_id = str(uuid.uuid4())
+        query_id = _QUERY_ID
         text = "not a valid sentence at all"
 
         query = NluQuery(
             input=text, id=query_id, site_id=self.site_id, session_id=self.session_id
         )
 
-        results = []
-        async for result in self.hermes.on_message(query):
-            results.append(result)
+        results = [result async for result in self.hermes.on_message(query)]
 
         # Check results
-        self.assertEqual(
-            results,
-            [
-                NluIntentNotRecognized(
+        expected = [
+            NluIntentNotRecognized(
+                input=text,
+                id=query_id,
+                site_id=self.site_id,
+                session_id=self.session_id,
+            )
+        ]
+
+        self.assertEqual(_payloads(results), _payloads(expected))
+
+    def test_not_recognized(self):
+        """Call async_test_not_recognized."""
+        _LOOP.run_until_complete(self.async_test_not_recognized())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_low_threshold(self):
+        """Verify a match just above a low threshold is recognized."""
+        # "music musics lite" scores ~50.9 against "play the music", which
+        # rapidfuzz 0.13 drops when the scorer is also given a cutoff of 50.
+        graph = intents_to_graph(parse_ini("[PlayMusic]\nplay the music"))
+        hermes = NluHermesMqtt(
+            self.client,
+            graph,
+            examples=rhasspyfuzzywuzzy_hermes._rapid.train(graph),
+            confidence_threshold=0.5,
+            site_ids=[self.site_id],
+        )
+
+        query = NluQuery(
+            input="music musics lite",
+            id=_QUERY_ID,
+            site_id=self.site_id,
+            session_id=self.session_id,
+        )
+
+        results = [result async for result in hermes.on_message(query)]
+
+        self.assertIsInstance(results[1][0], NluIntent)
+        self.assertEqual(results[1][0].intent.intent_name, "PlayMusic")
+        self.assertGreaterEqual(results[1][0].intent.confidence_score, 0.5)
+
+    def test_low_threshold(self):
+        """Call async_test_low_threshold."""
+        _LOOP.run_until_complete(self.async_test_low_threshold())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_replace_numbers(self):
+        """Verify digits in queries are replaced with words."""
+        graph = intents_to_graph(
+            parse_ini("[SetTemperature]\nset temperature to (seventy five){temp}")
+        )
+        hermes = NluHermesMqtt(
+            self.client,
+            graph,
+            examples=rhasspyfuzzywuzzy_hermes._rapid.train(graph),
+            replace_numbers=True,
+            confidence_threshold=1.0,
+            site_ids=[self.site_id],
+        )
+
+        # With and without digits
+        for text in ["set temperature to 75", "set temperature to seventy five"]:
+            query = NluQuery(
+                input=text,
+                id=_QUERY_ID,
+                site_id=self.site_id,
+                session_id=self.session_id,
+            )
+
+            results = [result async for result in hermes.on_message(query)]
+
+            nlu_intent = results[1][0]
+            self.assertEqual(nlu_intent.intent.intent_name, "SetTemperature")
+            self.assertEqual(nlu_intent.input, "set temperature to seventy five")
+            self.assertEqual(
+                [(slot.slot_name, slot.value["value"]) for slot in nlu_intent.slots],
+                [("temp", "seventy five")],
+            )
+
+            # Original text is kept
+            self.assertEqual(nlu_intent.raw_input, text)
+
+    def test_replace_numbers(self):
+        """Call async_test_replace_numbers."""
+        _LOOP.run_until_complete(self.async_test_replace_numbers())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_missing_ids(self):
+        """Verify a query without site/session ids still gets a reply."""
+        query = NluQuery(input="what time is it", id=_QUERY_ID, site_id=None)
+
+        results = [result async for result in self.hermes.on_message(query)]
+
+        self.assertIsInstance(results[1][0], NluIntent)
+        self.assertEqual(results[1][0].intent.intent_name, "GetTime")
+        self.assertIsNone(results[1][0].site_id)
+
+    def test_missing_ids(self):
+        """Call async_test_missing_ids."""
+        _LOOP.run_until_complete(self.async_test_missing_ids())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_not_loaded(self):
+        """Verify query without intent graph/examples leads to an error."""
+        hermes = NluHermesMqtt(self.client, site_ids=[self.site_id])
+        query = NluQuery(
+            input="what time is it",
+            id=_QUERY_ID,
+            site_id=self.site_id,
+            session_id=self.session_id,
+        )
+
+        results = [result async for result in hermes.on_message(query)]
+
+        self.assertEqual(len(results), 1)
+        self.assertIsInstance(results[0], NluError)
+        self.assertEqual(results[0].session_id, self.session_id)
+
+    def test_not_loaded(self):
+        """Call async_test_not_loaded."""
+        _LOOP.run_until_complete(self.async_test_not_loaded())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_recognition_cache(self):
+        """Verify repeated queries are cached until training."""
+        text = "what time is it"
+
+        for _ in range(2):
+            query = NluQuery(
+                input=text,
+                id=_QUERY_ID,
+                site_id=self.site_id,
+                session_id=self.session_id,
+            )
+
+            with patch(
+                "rhasspyfuzzywuzzy_hermes._rapid.recognize",
+                wraps=rhasspyfuzzywuzzy_hermes._rapid.recognize,
+            ) as recognize:
+                results = [result async for result in self.hermes.on_message(query)]
+
+            self.assertEqual(results[1][0].intent.intent_name, "GetTime")
+
+        # Second query should come from the cache
+        recognize.assert_not_called()
+        self.assertEqual(len(self.hermes._recog_cache), 1)
+
+        # Training clears the cache
+        train = NluTrain(id=_TRAIN_ID, graph_path=str(self.graph_path))
+        async for _ in self.hermes.on_message(train, site_id=self.site_id):
+            pass
+
+        self.assertEqual(len(self.hermes._recog_cache), 0)
+
+    def test_recognition_cache(self):
+        """Call async_test_recognition_cache."""
+        _LOOP.run_until_complete(self.async_test_recognition_cache())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_filter_reuses_unfiltered(self):
+        """Verify a filtered query reuses an unfiltered result when it can."""
+        text = "what time is it"
+
+        def make_query(intent_filter=None):
+            return NluQuery(
+                input=text,
+                id=_QUERY_ID,
+                intent_filter=intent_filter,
+                site_id=self.site_id,
+                session_id=self.session_id,
+            )
+
+        async for _ in self.hermes.on_message(make_query()):
+            pass
+
+        with patch(
+            "rhasspyfuzzywuzzy_hermes._rapid.recognize",
+            wraps=rhasspyfuzzywuzzy_hermes._rapid.recognize,
+        ) as recognize:
+            # Best intent is in the filter
+            results = [
+                result
+                async for result in self.hermes.on_message(make_query(["GetTime"]))
+            ]
+            self.assertEqual(results[1][0].intent.intent_name, "GetTime")
+            recognize.assert_not_called()
+
+            # Best intent is filtered out, so scoring has to run again
+            results = [
+                result
+                async for result in self.hermes.on_message(
+                    make_query(["SetLightColor"])
+                )
+            ]
+            self.assertIsInstance(results[0], NluIntentNotRecognized)
+            recognize.assert_called_once()
+
+    def test_filter_reuses_unfiltered(self):
+        """Call async_test_filter_reuses_unfiltered."""
+        _LOOP.run_until_complete(self.async_test_filter_reuses_unfiltered())
+
+    # -------------------------------------------------------------------------
+
+    async def async_test_filter_after_not_recognized(self):
+        """Verify a failed unfiltered query isn't reused for a filtered one."""
+        text = "what time is it"
+        real_recognize = rhasspyfuzzywuzzy_hermes._rapid.recognize
+
+        def recognize(*args, **kwargs):
+            if kwargs.get("intent_filter") is None:
+                # Unfiltered query fails
+                return []
+
+            return real_recognize(*args, **kwargs)
+
+        with patch("rhasspyfuzzywuzzy_hermes._rapid.recognize", new=recognize):
+            for intent_filter in [None, ["GetTime"]]:
+                query = NluQuery(
                     input=text,
-                    id=query_id,
+                    id=_QUERY_ID,
+                    intent_filter=intent_filter,
                     site_id=self.site_id,
                     session_id=self.session_id,
                 )
-            ],
-        )
+                results = [result async for result in self.hermes.on_message(query)]
 
-    def test_not_recognized(self):
-        """Call async_test_not_recognized."""
-        _LOOP.run_until_complete(self.async_test_not_recognized())
+        # Filtered query was scored on its own
+        self.assertIsInstance(results[1][0], NluIntent)
+        self.assertEqual(results[1][0].intent.intent_name, "GetTime")
+
+    def test_filter_after_not_recognized(self):
+        """Call async_test_filter_after_not_recognized."""
+        _LOOP.run_until_complete(self.async_test_filter_after_not_recognized())
+
+    # -------------------------------------------------------------------------
+
+    def test_exact_cutoff_skips_scoring(self):
+        """Verify near misses aren't scored when only exact matches pass."""
+        with patch.object(
+            rhasspyfuzzywuzzy_hermes._rapid.fuzzy_process, "extractOne"
+        ) as extract_one:
+            recognitions = rhasspyfuzzywuzzy_hermes._rapid.recognize(
+                "set the bedroom light to reds",
+                self.graph,
+                self.examples,
+                score_cutoff=100.0,
+            )
+
+        self.assertEqual(recognitions, [])
+        extract_one.assert_not_called()
+
+    # -------------------------------------------------------------------------
+
+    def test_train_examples(self):
+        """Verify generated examples match rhasspyfuzzywuzzy."""
+        self.assertEqual(self.examples, rhasspyfuzzywuzzy.train(self.graph))
 
     # -------------------------------------------------------------------------
 
     async def async_test_train_success(self):
         """Verify successful training."""
-        train_id = str(uuid.uuid4())
+        train_id = _TRAIN_ID
 
         def fake_read_graph(*args, **kwargs):
             return MagicMock()
 
+        train_calls = []
+
         def fake_train(*args, **kwargs):
+            train_calls.append(args)
             return MagicMock()
 
-        # Create temporary file for "open"
-        with tempfile.NamedTemporaryFile(mode="wb+", suffix=".gz") as graph_file:
-            train = NluTrain(id=train_id, graph_path=graph_file.name)
+        # Graph file is only hashed; loading and training are faked
+        train = NluTrain(id=train_id, graph_path=str(self.graph_path))
 
-            # Ensure fake graph "loads" and training goes through
-            with patch("rhasspynlu.gzip_pickle_to_graph", new=fake_read_graph):
-                with patch("rhasspyfuzzywuzzy.train", new=fake_train):
-                    results = []
-                    async for result in self.hermes.on_message(
-                        train, site_id=self.site_id
-                    ):
-                        results.append(result)
+        # Ensure fake graph "loads" and training goes through
+        with patch("rhasspyfuzzywuzzy_hermes.read_graph", new=fake_read_graph):
+            with patch("rhasspyfuzzywuzzy_hermes._rapid.train", new=fake_train):
+                # Second request with the same graph skips training
+                for _ in range(2):
+                    results = [
+                        result
+                        async for result in self.hermes.on_message(
+                            train, site_id=self.site_id
+                        )
+                    ]
 
-            self.assertEqual(
-                results, [(NluTrainSuccess(id=train_id), {"site_id": self.site_id})]
-            )
+                    self.assertEqual(
+                        results,
+                        [(NluTrainSuccess(id=train_id), {"site_id": self.site_id})],
+                    )
+
+        self.assertEqual(len(train_calls), 1)
 
     def test_train_success(self):
         """Call async_test_train_success."""
@@ -233,14 +532,58 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
 
     # -------------------------------------------------------------------------
 
+    async def async_test_train_round_trip(self):
+        """Verify examples written by training are loaded by a new service."""
+        examples_path = Path(self.temp_dir.name) / "examples.db"
+        self.hermes.examples = None
+        self.hermes.examples_path = examples_path
+
+        train = NluTrain(id=_TRAIN_ID, graph_path=str(self.graph_path))
+        async for _ in self.hermes.on_message(train, site_id=self.site_id):
+            pass
+
+        self.assertTrue(examples_path.is_file())
+
+        # Graph and examples come from disk at startup
+        hermes = NluHermesMqtt(
+            self.client,
+            intent_graph_path=self.graph_path,
+            examples_path=examples_path,
+            confidence_threshold=1.0,
+            site_ids=[self.site_id],
+        )
+        self.assertEqual(hermes.examples, self.examples)
+
+        text = "set the bedroom light to red"
+        query = NluQuery(
+            input=text, id=_QUERY_ID, site_id=self.site_id, session_id=self.session_id
+        )
+
+        results = [result async for result in hermes.on_message(query)]
+
+        intent = results[1][0].intent
+        self.assertEqual(intent.intent_name, _SET_LIGHT_COLOR_INTENT.intent_name)
+        self.assertEqual(intent.confidence_score, 1.0)
+        self.assertEqual(
+            [slot.to_dict() for slot in results[1][0].slots],
+            [slot.to_dict() for slot in _SET_LIGHT_COLOR_SLOTS],
+        )
+
+    def test_train_round_trip(self):
+        """Call async_test_train_round_trip."""
+        _LOOP.run_until_complete(self.async_test_train_round_trip())
+
+    # -------------------------------------------------------------------------
+
     async def async_test_train_error(self):
         """Verify training error."""
         train = NluTrain(id=self.session_id, graph_path=Path("fake-graph.pickle.gz"))
 
         # Allow failed attempt to access missing graph
-        results = []
-        async for result in self.hermes.on_message(train, site_id=self.site_id):
-            results.append(result)
+        results = [
+            result
+            async for result in self.hermes.on_message(train, site_id=self.site_id)
+        ]
 
         self.assertEqual(len(results), 1)
         result = results[0]
@@ -251,3 +594,88 @@ class RhasspyFuzzywuzzyHermesTestCase(unittest.TestCase):
     def test_train_error(self):
         """Call async_test_train_error."""
         _LOOP.run_until_complete(self.async_test_train_error())
+
+    # -------------------------------------------------------------------------
+
+    def test_warm_up(self):
+        """Verify warming up doesn't build a recognition (or run converters)."""
+        with patch("rhasspynlu.fsticuffs.path_to_recognition") as path_to_recognition:
+            self.hermes._warm_up()
+
+        path_to_recognition.assert_not_called()
+
+    # -------------------------------------------------------------------------
+
+    @patch.dict(sys.modules, {"uvloop": None})
+    @patch("rhasspyfuzzywuzzy_hermes.__main__.asyncio.run")
+    @patch("rhasspyfuzzywuzzy_hermes.__main__.hermes_cli.connect")
+    @patch("rhasspyfuzzywuzzy_hermes.__main__.mqtt.Client")
+    def test_casing(self, *_mocks):
+        """Verify --casing selects the service's word transform."""
+        for casing, word_transform in [
+            ("upper", str.upper),
+            ("lower", str.lower),
+            ("ignore", None),
+        ]:
+            argv = ["rhasspy-fuzzywuzzy-hermes", "--casing", casing]
+            with patch.object(sys, "argv", argv), patch(
+                "rhasspyfuzzywuzzy_hermes.__main__.NluHermesMqtt"
+            ) as hermes_class:
+                rhasspyfuzzywuzzy_hermes.__main__.main()
+
+            self.assertIs(
+                hermes_class.call_args[1]["word_transform"], word_transform, casing
+            )
+
+    # -------------------------------------------------------------------------
+
+    def test_tcp_nodelay(self):
+        """Verify Nagle's algorithm is disabled on connect."""
+        client = MagicMock()
+        self.hermes.mqtt_on_connect(client, None, None, 0)
+        client.socket().setsockopt.assert_called_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
+    # -------------------------------------------------------------------------
+
+    def test_publish(self):
+        """Verify JSON payload matches the message."""
+        message = NluIntentNotRecognized(
+            input="tschüss",
+            id=_QUERY_ID,
+            site_id=self.site_id,
+            session_id=self.session_id,
+            custom_data="custom",
+        )
+
+        client = self.hermes.mqtt_client = MagicMock()
+        self.hermes.publish(message)
+
+        client.publish.assert_called_once()
+        topic, payload = client.publish.call_args[0]
+        self.assertEqual(topic, message.topic())
+        self.assertEqual(json.loads(payload), message.to_dict())
+
+    def test_publish_intent(self):
+        """Verify JSON payload of a recognized intent matches the message."""
+        text = "set the bedroom light to red"
+        message = NluIntent(
+            input=text,
+            id=_QUERY_ID,
+            site_id=self.site_id,
+            session_id=self.session_id,
+            intent=_SET_LIGHT_COLOR_INTENT,
+            slots=list(_SET_LIGHT_COLOR_SLOTS),
+            asr_tokens=[NluIntent.make_asr_tokens(text.split())],
+            raw_input=text,
+            custom_data="custom",
+        )
+
+        client = self.hermes.mqtt_client = MagicMock()
+        self.hermes.publish(message, intent_name=message.intent.intent_name)
+
+        client.publish.assert_called_once()
+        topic, payload = client.publish.call_args[0]
+        self.assertEqual(topic, message.topic(intent_name="SetLightColor"))
+        self.assertEqual(json.loads(payload), message.to_dict())